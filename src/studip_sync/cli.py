@@ -31,9 +31,13 @@ def app():
     
     if args.command == 'sync':
         studip_sync.sync()
+        studip_sync.git_push()
     elif args.command == 'select-semester':
         studip_sync.select_semester(args.semester)
+        studip_sync.git_push()
     elif args.command == 'get-cookie':
         print(studip_sync.get_cookie())
     else:
         parser.print_help()
+
+    studip_sync.wait_for_git()
@@ -1,18 +1,27 @@
 #!/bin/env python3
 import os
-import configparser
+import functools
 import platform
-import json
 import shutil
 import subprocess
-import requests
-import tempfile
-import re
+import shlex
 import sys
 
+# Heavy modules (requests stack, aiohttp, lz4, orjson, configparser) are
+# imported lazily at their use sites so --help and one-off invocations
+# don't pay their import cost
+
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
+# Platform-dependent firefox profiles directory, resolved once at import
+# (None on unsupported platforms)
+_FIREFOX_DIR = {
+    "Windows": os.path.join(os.path.expanduser("~"), "AppData", "Roaming", "Mozilla", "Firefox", "Profiles"),
+    "Linux": os.path.join(os.path.expanduser("~"), ".mozilla", "firefox"),
+    "Darwin": os.path.join(os.path.expanduser("~"), "Library", "Application Support", "Firefox", "Profiles"),
+}.get(platform.system())
+
 class FzfPrompt:
     def __init__(self, executable_path=None):
         if executable_path:
@@ -26,27 +35,16 @@ class FzfPrompt:
     def prompt(self, choices=None, fzf_options="", delimiter='\n'):
         # convert a list to a string [ 1, 2, 3 ] => "1\n2\n3"
         choices_str = delimiter.join(map(str, choices))
-        selection = []
-
-        with tempfile.NamedTemporaryFile(delete=False) as input_file:
-            with tempfile.NamedTemporaryFile(delete=False) as output_file:
-                # Create a temp file with list entries as lines
-                input_file.write(choices_str.encode('utf-8'))
-                input_file.flush()
-
-        # Invoke fzf externally and write to output file
-        os.system(
-            f"{self.executable_path} {fzf_options} < \"{input_file.name}\" > \"{output_file.name}\"")
-
-        # get selected options
-        with open(output_file.name, encoding="utf-8") as f:
-            for line in f:
-                selection.append(line.strip('\n'))
 
-        os.unlink(input_file.name)
-        os.unlink(output_file.name)
+        # Pipe the choices straight through fzf: no shell, no temp files
+        # (fzf exits non-zero when the prompt is cancelled, which simply
+        # yields an empty selection)
+        proc = subprocess.run(
+            [self.executable_path, *shlex.split(fzf_options)],
+            input=choices_str.encode("utf-8"),
+            stdout=subprocess.PIPE)
 
-        return selection
+        return proc.stdout.decode("utf-8").splitlines()
 
 class StudipSync:
     # Config
@@ -59,9 +57,9 @@ class StudipSync:
     git_commit_message_prefix = "studip-sync: "
 
     # Cache
-    cookie = None
     current_semester = None
     user_id = None
+    _push_process = None
 
     # constructor defaults all non specified config values to the default values (config is passed through from arguments in some explicit way
     def __init__(self, config={}):
@@ -80,50 +78,104 @@ class StudipSync:
             self.top_level = git_top_level_process.stdout.decode("utf-8").strip()
         self.load_current_semester()
 
-    def get_firefox_profile_dir(self): # Get main firefox profile directory
-        if platform.system() == "Windows":
-            firefox_dir = os.path.join(os.path.expanduser("~"), "AppData", "Roaming", "Mozilla", "Firefox", "Profiles")
-        elif platform.system() == "Linux":
-            firefox_dir = os.path.join(os.path.expanduser("~"), ".mozilla", "firefox")
-        elif platform.system() == "Darwin":
-            firefox_dir = os.path.join(os.path.expanduser("~"), "Library", "Application Support", "Firefox", "Profiles")
-        else:
+    @functools.cached_property
+    def session(self):
+        # Built on first API call so commands that never talk to the API
+        # don't import the requests stack or touch the cache file.
+        # Reuse one pooled connection to the studip host instead of a fresh
+        # TLS handshake per request; idempotent GETs are additionally served
+        # from an on-disk cache for an hour so repeated syncs skip most API
+        # round trips (downloads bypass the cache, they are guarded by the
+        # existing on-disk file check)
+        # cache_control makes the session store ETag and Last-Modified
+        # validators; once an entry expires the re-request goes out
+        # conditionally (If-None-Match/If-Modified-Since), so an unchanged
+        # resource costs a bodyless 304 served from the cache while fresh
+        # entries are answered locally without any round trip
+        import requests_cache
+        from requests.adapters import HTTPAdapter, Retry
+        session = requests_cache.CachedSession(
+            os.path.join(self.data_path, ".studip-cache"),
+            expire_after=3600,
+            cache_control=True,
+            allowable_methods=("GET",),
+            urls_expire_after={"*/download": requests_cache.DO_NOT_CACHE})
+        session.mount("https://", HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])))
+        # The cookie lives in the session's jar, set once; requests emits it
+        # on every request without any per-call header assembly
+        session.cookies.set("Seminar_Session", self.get_cookie(), domain=self.studip_host)
+        return session
+
+    @functools.cached_property
+    def executor(self):
+        # Thread pool for fanning out independent metadata requests; sized to
+        # the connection pool so all keep-alive connections get used
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=16)
+
+    @functools.cached_property
+    def firefox_profile_dir(self): # Get main firefox profile directory (parsed once per process)
+        import configparser
+        if _FIREFOX_DIR is None:
             raise NotImplementedError(f"Platform \"{platform.system()}\" not supported")
         # Reading profiles.ini to get the default profile
-        profiles_ini = os.path.join(firefox_dir, "profiles.ini")
+        profiles_ini = os.path.join(_FIREFOX_DIR, "profiles.ini")
         firefoxProfilesConfig = configparser.ConfigParser()
         firefoxProfilesConfig.read(profiles_ini)
         profile = firefoxProfilesConfig["Profile0"]["Path"] # Unsure if this is correct
-        return os.path.join(firefox_dir, profile)
+        return os.path.join(_FIREFOX_DIR, profile)
 
-    def get_cookie_from_browser(self):
-        if self.cookie is not None:
-            return self.cookie
+    @functools.cached_property
+    def cookie_value(self): # Browser cookie extraction runs exactly once per process
         if self.browser == "firefox":
-            cookieFilePath = os.path.join(self.get_firefox_profile_dir(), "sessionstore-backups", "recovery.jsonlz4")
-            # Check if dejsonlz4 is in PATH
-            dejsonlz4PathLoc = shutil.which("dejsonlz4")
-            if dejsonlz4PathLoc:
-                dejsonlz4 = dejsonlz4PathLoc
-            else:
-                if shutil.which("dejsonlz4.com"):
-                    dejsonlz4 = "dejsonlz4.com"
-                else:
-                    raise FileNotFoundError("dejsonlz4 not found")
+            import lz4.block
+            import orjson
+            cookieFilePath = os.path.join(self.firefox_profile_dir, "sessionstore-backups", "recovery.jsonlz4")
+            # Mozilla's jsonlz4 is plain lz4 block data behind an 8 byte
+            # "mozLz40\0" magic header, so decompress it in-process instead
+            # of spawning dejsonlz4 and piping the JSON through
+            with open(cookieFilePath, "rb") as f:
+                raw = f.read()
+            if raw[:8] != b"mozLz40\0":
+                raise ValueError(f"{cookieFilePath} is not a mozLz4 file")
             studip_host = self.studip_host
-            cookies_process = subprocess.run([dejsonlz4, cookieFilePath], capture_output=True)
-            cookies = json.loads(cookies_process.stdout)["cookies"]
+            cookies = orjson.loads(lz4.block.decompress(raw[8:]))["cookies"]
             for cookie in cookies:
                 if cookie["host"] == studip_host and cookie["name"] == "Seminar_Session":
-                    self.cookie = cookie['value']
                     return cookie['value']
             raise KeyError("Cookie not found")
         else:
             raise NotImplementedError(f"Browser \"{self.browser}\" not supported")
 
+    def _git_commit_if_changed(self, paths, message):
+        # status --porcelain is empty when nothing changed; the previous
+        # diff-based check split "" into [""] and therefore always committed.
+        # Paths are relative to the repository (git -C chdirs first).
+        status = subprocess.run(["git", "-C", self.data_path, "status", "--porcelain", "--", *paths],
+                                capture_output=True)
+        if not status.stdout.strip():
+            return
+        subprocess.run(["git", "-C", self.data_path, "add", "--", *paths])
+        subprocess.run(["git", "-C", self.data_path, "commit", "-m", self.git_commit_message_prefix + message])
+
+    def git_push(self):
+        # Called once at the end of a CLI command instead of after every
+        # commit; the push runs in the background (it can take seconds over
+        # SSH) and wait_for_git() joins it before the process exits
+        if self.use_git:
+            self._push_process = subprocess.Popen(["git", "-C", self.data_path, "push"])
+
+    def wait_for_git(self):
+        if self._push_process is not None:
+            self._push_process.wait()
+            self._push_process = None
+
     def get_cookie(self):
         if self.auth_method == "cookie":
-            return self.get_cookie_from_browser()
+            return self.cookie_value
         else:
             raise NotImplementedError(f"Auth method \"{self.auth_method}\" not supported")
 
@@ -137,27 +189,41 @@ class StudipSync:
         path = path.removeprefix(self.prefix)
         url = f"https://{self.studip_host}{self.prefix}{path}"
         eprint(f"GET {url}")
-        resp = requests.get(url, headers={"Cookie": f"Seminar_Session={self.get_cookie()}"})
+        resp = self.session.get(url)
         if resp.status_code != 200:
             raise Exception(f"Failed to get {url}: {resp.status_code}")
         return resp
 
-    def get_no_parse(self, path):
-        return self.get_req(path).content
-
     def get(self, path):
-        return self.get_req(path).json()
+        import orjson
+        return orjson.loads(self.get_req(path).content)
 
     def get_subfolders(self, folder):
-        if "is_readable" in folder and folder["is_readable"]:
-            subfolders = self.get(f"/folder/{folder['id']}/subfolders")["collection"]
-            folder["files"] = self.get(f"/folder/{folder['id']}/files")["collection"]
-            folder["subfolders"] = []
-            for subfolder in subfolders:
-                folder["subfolders"].append(self.get_subfolders(subfolder))
-            return folder
-        else:
+        if not ("is_readable" in folder and folder["is_readable"]):
             return {"files": [], "subfolders": []}
+        # Walk the tree level by level, fetching the subfolder and file
+        # listings of every folder on the current level in parallel; sibling
+        # subtrees are independent so each level is one round trip instead of
+        # two sequential GETs per folder
+        pending = [folder]
+        while pending:
+            requested = []
+            for current in pending:
+                requested.append((current,
+                                  self.executor.submit(self.get, f"/folder/{current['id']}/subfolders"),
+                                  self.executor.submit(self.get, f"/folder/{current['id']}/files")))
+            pending = []
+            for current, subfolders_future, files_future in requested:
+                subfolders = subfolders_future.result()["collection"]
+                current["files"] = files_future.result()["collection"]
+                current["subfolders"] = []
+                for subfolder in subfolders:
+                    if "is_readable" in subfolder and subfolder["is_readable"]:
+                        current["subfolders"].append(subfolder)
+                        pending.append(subfolder)
+                    else:
+                        current["subfolders"].append({"files": [], "subfolders": []})
+        return folder
 
     def get_courses(self, semester_id=None):
         courses = []
@@ -166,13 +232,26 @@ class StudipSync:
         else:
             raw_courses = self.get(f"/user/{self.get_user_id()}/courses?semester={semester_id}")["collection"]
 
-        for course in raw_courses.values():
+        # Fetch every course's top folder in parallel, then every top folder's
+        # file listing in parallel; only the subtree walks below depend on
+        # these results
+        top_folder_futures = {}
+        for key, course in raw_courses.items():
             path = course["modules"]["documents"] if "documents" in course["modules"] else None
             if path is not None:
-                course["top_folder"] = self.get(path)
+                top_folder_futures[key] = self.executor.submit(self.get, path)
 
+        files_futures = {}
+        for key, course in raw_courses.items():
+            if key in top_folder_futures:
+                course["top_folder"] = top_folder_futures[key].result()
             if "top_folder" in course and "id" in course["top_folder"] and course["top_folder"]["id"]:
-                course["top_folder"]["files"] = self.get(f"/folder/{course['top_folder']['id']}/files")["collection"]
+                files_futures[key] = self.executor.submit(
+                    self.get, f"/folder/{course['top_folder']['id']}/files")
+
+        for key, course in raw_courses.items():
+            if key in files_futures:
+                course["top_folder"]["files"] = files_futures[key].result()["collection"]
 
             if "top_folder" in course and "subfolders" in course["top_folder"] and course["top_folder"]["subfolders"]:
                 subfolders = []
@@ -188,10 +267,11 @@ class StudipSync:
     def escape_filename(self, name):
         return name.replace("/", "_")
 
+    # forbidden symbols: "<" ">" ":" "\"" "\\" "|" "?" "*"
+    _CLEAN_TABLE = str.maketrans({symbol: "_" for symbol in '<>:"\\|?*'})
+
     def clean_path(self, path):
-        # forbidden symbols: "<" ">" ":" "\"" "\\" "|" "?" "*"
-        dirty_symbols_regex = r"[<>:\"\\|?*]"
-        return re.sub(dirty_symbols_regex, "_", path)
+        return path.translate(self._CLEAN_TABLE)
 
     def get_current_semester(self):
         if self.current_semester is None:
@@ -209,14 +289,7 @@ class StudipSync:
         for course in list(set([self.escape_filename(course["title"]) for course in courses])):
             os.symlink(os.path.join("..", "archive" , course), os.path.join(current_semester_path, course), target_is_directory=True)
         if self.use_git:
-            # Count changes in this-semester dir
-            changesProcess = subprocess.run(["git", "-C", self.data_path, "diff", "--name-only", "--", "current-semester"], capture_output=True)
-            changes = changesProcess.stdout.decode("utf-8").split("\n")
-            if len(changes) > 0:
-                # Commit changes
-                subprocess.run(["git", "-C", self.data_path, "add", current_semester_path])
-                subprocess.run(["git", "-C", self.data_path, "commit", "-m", self.git_commit_message_prefix + "updated this-semester links"])
-                subprocess.run(["git", "-C", self.data_path, "push"])
+            self._git_commit_if_changed(["this-semester"], "updated this-semester links")
 
     def select_semester(self, semester=None):
         semesters = self.get("/semesters")["collection"]
@@ -246,21 +319,69 @@ class StudipSync:
         with open(os.path.join(self.data_path, ".current-semester"), "w") as f:
             f.write(semester_id)
         if self.use_git:
-            subprocess.run(["git", "-C", self.data_path, "add", ".current-semester"])
-            subprocess.run(["git", "-C", self.data_path, "commit", "-m", self.git_commit_message_prefix + "updated current semester"])
-            subprocess.run(["git", "-C", self.data_path, "push"]) # IDEA: push will be done one layer above this if head changed
+            self._git_commit_if_changed([".current-semester"], "updated current semester")
 
 
     def get_files(self, folder, parent_path):
+        # Explicit stack instead of recursion: everything lands in one output
+        # dict, with no per-subfolder dict merges or recursion frames
         files = {}
-        for file in folder["files"]:
-            files[f"{parent_path}/{file['name']}"] = file["id"]
-        if "subfolders" in folder:
-            for subfolder in folder["subfolders"]:
-                for key,value in self.get_files(subfolder, f"{parent_path}/{folder['name']}").items():
-                    files[key] = value
+        stack = [(folder, parent_path)]
+        while stack:
+            current, path = stack.pop()
+            for file in current["files"]:
+                # The folder listing already carries is_downloadable, so keep it
+                # around and spare sync() a /file/<id> round trip per new file
+                files[f"{path}/{file['name']}"] = {
+                    "id": file["id"],
+                    "is_downloadable": file.get("is_downloadable")}
+            for subfolder in current.get("subfolders", ()):
+                stack.append((subfolder, f"{path}/{current['name']}"))
         return files
 
+    async def _download(self, session, sem, path, file_path):
+        url = f"https://{self.studip_host}{self.prefix}{path}"
+        # Stream into a temporary name and only move it into place once the
+        # body is complete: a mid-body error, Ctrl-C or cancellation must not
+        # leave a truncated file that later syncs would treat as done
+        tmp_path = file_path + ".part"
+        async with sem:
+            eprint(f"GET {url}")
+            try:
+                async with session.get(url) as resp:
+                    if resp.status != 200:
+                        raise Exception(f"Failed to get {url}: {resp.status}")
+                    with open(tmp_path, 'wb') as f:
+                        while chunk := await resp.content.read(64 * 1024):
+                            f.write(chunk)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        os.replace(tmp_path, file_path)
+
+    async def _download_all(self, downloads):
+        import asyncio
+        import aiohttp
+        # Cap in-flight downloads so we don't hammer the server; the
+        # connector limit bounds open connections on top of that
+        sem = asyncio.Semaphore(8)
+        async with aiohttp.ClientSession(
+                cookies={"Seminar_Session": self.get_cookie()},
+                connector=aiohttp.TCPConnector(limit=16)) as session:
+            # return_exceptions keeps one bad file from cancelling its
+            # siblings mid-write; failures are reported after everything
+            # else finished
+            results = await asyncio.gather(
+                *(self._download(session, sem, path, file_path)
+                  for path, file_path in downloads),
+                return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        for error in errors:
+            eprint(f"Download failed: {error}")
+        if errors:
+            raise Exception(f"{len(errors)} downloads failed")
+
     def sync(self):
         courses = self.get_courses(self.current_semester)
         files = {}
@@ -269,15 +390,33 @@ class StudipSync:
                 for key, value in self.get_files(course["top_folder"], course["title"]).items():
                     files[key] = value
 
+        # One walk over the archive replaces a stat(2) per candidate file;
+        # created directories are tracked so makedirs runs once per directory
+        archive_path = os.path.join(self.data_path, "archive")
+        existing = set()
+        for root, _, existing_files in os.walk(archive_path):
+            existing.update(os.path.join(root, name) for name in existing_files)
+        created_dirs = set()
+
+        downloads = []
         for file in files:
             file_path = self.clean_path(os.path.join(self.data_path, "archive", file))
-            if not os.path.exists(file_path):
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                eprint(f"Downloading {file} to {file_path}")
-                file_meta = self.get(f"/file/{files[file]}")
-                if file_meta["is_downloadable"]:
-                    with open(file_path, 'wb') as f:
-                        f.write(self.get_no_parse(f"/file/{files[file]}/download"))
+            if file_path not in existing:
+                # Mark the path as taken right away: two entries can
+                # clean_path() to the same file and must not both be
+                # scheduled, or their downloads would interleave
+                existing.add(file_path)
+                dir_path = os.path.dirname(file_path)
+                if dir_path not in created_dirs:
+                    os.makedirs(dir_path, exist_ok=True)
+                    created_dirs.add(dir_path)
+                is_downloadable = files[file]["is_downloadable"]
+                if is_downloadable is None:
+                    # Listing didn't carry the flag, fall back to the per-file lookup
+                    is_downloadable = self.get(f"/file/{files[file]['id']}")["is_downloadable"]
+                if is_downloadable:
+                    eprint(f"Downloading {file} to {file_path}")
+                    downloads.append((f"/file/{files[file]['id']}/download", file_path))
                 else:
                     eprint(f"File {file} is not downloadable")
                     eprint(f"Creating placeholder file {file_path}")
@@ -285,12 +424,9 @@ class StudipSync:
                     with open(file_path, 'w') as f:
                         f.write("studip-sync:non-downloadable-file")
 
+        if downloads:
+            import asyncio
+            asyncio.run(self._download_all(downloads))
+
         if self.use_git:
-            # Count changes in archive dir
-            changesProcess = subprocess.run(["git", "-C", self.data_path, "diff" , "--name-only", "--", "archive"], capture_output=True)
-            changes = changesProcess.stdout.decode("utf-8").split("\n")
-            if len(changes) > 0:
-                # Commit changes
-                subprocess.run(["git", "-C", self.data_path, "add", os.path.join(self.data_path, "archive")])
-                subprocess.run(["git", "-C", self.data_path, "commit", "-m", self.git_commit_message_prefix + "updated archive"])
-                subprocess.run(["git", "-C", self.data_path, "push"])
+            self._git_commit_if_changed(["archive"], "updated archive")